@@ -3,17 +3,62 @@ import sys
 import argparse
 
 from vcfiterator import VcfIterator
+from vcfiterator.aggregators import default_aggregators
+from vcfiterator.loader import SqliteLoader
 
-parser = argparse.ArgumentParser("Iterates over a .vcf file, outputting one JSON structure per line")
-parser.add_argument("vcf_file", help="Path to .vcf file")
-parser.add_argument("--pretty", action="store_true", help="Pretty print JSON")
 
-args = parser.parse_args()
-path = args.vcf_file
-v = VcfIterator(path)
+def dump(argv):
+    parser = argparse.ArgumentParser("Iterates over a .vcf file, outputting one JSON structure per line")
+    parser.add_argument("vcf_file", help="Path to .vcf file")
+    parser.add_argument("--pretty", action="store_true", help="Pretty print JSON")
+
+    args = parser.parse_args(argv)
+    path = args.vcf_file
+    v = VcfIterator(path)
+
+    for value in v.iter():
+        kw = {}
+        if args.pretty:
+            kw['indent'] = 4
+        print json.dumps(value, **kw)
+
+
+def stats(argv):
+    parser = argparse.ArgumentParser("Computes summary statistics over a .vcf file in a single pass, outputting JSON")
+    parser.add_argument("vcf_file", help="Path to .vcf file")
+    parser.add_argument("--processes", type=int, default=1, help="Number of processes to use")
+    parser.add_argument("--pretty", action="store_true", help="Pretty print JSON")
+
+    args = parser.parse_args(argv)
+    v = VcfIterator(args.vcf_file)
+    result = v.aggregate(default_aggregators(), processes=args.processes)
 
-for value in v.iter():
     kw = {}
     if args.pretty:
         kw['indent'] = 4
-    print json.dumps(value, **kw)
+    print json.dumps(result, **kw)
+
+
+def load(argv):
+    parser = argparse.ArgumentParser("Loads a .vcf file into a SQLite database")
+    parser.add_argument("vcf_file", help="Path to .vcf file")
+    parser.add_argument("db_file", help="Path to SQLite database, created if missing")
+    parser.add_argument("--batch-size", type=int, default=10000, help="Number of variants per batch of inserts")
+    parser.add_argument("--commit-size", type=int, default=100000, help="Number of variants per transaction")
+
+    args = parser.parse_args(argv)
+    v = VcfIterator(args.vcf_file)
+    loader = SqliteLoader(v, args.db_file, batch_size=args.batch_size, commit_size=args.commit_size)
+    count = loader.load()
+    sys.stderr.write("Loaded {} variants into {}\n".format(count, args.db_file))
+
+
+COMMANDS = {
+    'stats': stats,
+    'load': load
+}
+
+if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+    COMMANDS[sys.argv[1]](sys.argv[2:])
+else:
+    dump(sys.argv[1:])
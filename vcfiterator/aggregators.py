@@ -0,0 +1,312 @@
+import abc
+import bisect
+from collections import Counter
+
+from vcfiterator.processors import VEPInfoProcessor
+from vcfiterator.util import Util
+
+
+class RawRecord(object):
+    """
+    Lightweight view of a single data line, handed to the aggregators.
+
+    The line is only split into columns up front. INFO is split into raw (unconverted) strings on first access,
+    and the fully parsed data structure (as returned by VcfIterator.iter()) is only built if an aggregator asks for it.
+    """
+
+    def __init__(self, line, columns, data_parser):
+        self.line = line
+        self.fields = line.split('\t')
+        self._columns = columns
+        self._data_parser = data_parser
+        self._alt = None
+        self._info = None
+        self._data = None
+
+    @property
+    def meta(self):
+        return self._data_parser.meta
+
+    def get(self, column):
+        """
+        Returns the raw string value of a column (e.g. 'CHROM', 'QUAL' or a sample name).
+        """
+        return self.fields[self._columns[column]]
+
+    @property
+    def alt(self):
+        if self._alt is None:
+            self._alt = self.get('ALT').split(',')
+        return self._alt
+
+    @property
+    def info(self):
+        """
+        INFO as a dictionary of raw string values. Flags are given the value True.
+        """
+        if self._info is None:
+            self._info = dict()
+            for f in self.get('INFO').split(';'):
+                if '=' in f:
+                    key, value = f.split('=', 1)
+                else:
+                    key, value = f, True
+                self._info[key] = value
+        return self._info
+
+    @property
+    def data(self):
+        """
+        Fully parsed data, using the info processors of the iterator.
+        """
+        if self._data is None:
+            self._data = self._data_parser._parseData(self.line)
+        return self._data
+
+
+class BaseAggregator(object):
+    """
+    Base class for aggregators, computing a summary over all data lines in a single pass.
+
+    All state must be kept in self.state, and must be picklable. Partial states from different
+    chunks of the file (possibly computed in other processes) are combined using merge().
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    name = None
+
+    def __init__(self):
+        # Subclasses set their own attributes before calling this, as initial() may depend on them
+        self.reset()
+
+    def reset(self):
+        self.state = self.initial()
+
+    @abc.abstractmethod
+    def initial(self):
+        """
+        Returns a new, empty state.
+        """
+        pass
+
+    @abc.abstractmethod
+    def update(self, record):
+        """
+        Updates self.state with the data from one line.
+
+        :param record: The current line.
+        :type record: RawRecord
+        """
+        pass
+
+    @abc.abstractmethod
+    def merge(self, other):
+        """
+        Merges the state of another aggregator of the same kind into self.state.
+
+        :param other: Aggregator with a partial state.
+        """
+        pass
+
+    def result(self):
+        """
+        Returns the final result of the aggregation. Should be JSON serializable.
+        """
+        return self.state
+
+
+class CounterAggregator(BaseAggregator):
+    """
+    Base class for aggregators keeping their state in a collections.Counter.
+    """
+
+    def initial(self):
+        return Counter()
+
+    def merge(self, other):
+        self.state.update(other.state)
+
+    def result(self):
+        return dict(self.state)
+
+
+class RecordCount(BaseAggregator):
+    """
+    Counts the number of data lines.
+    """
+
+    name = 'records'
+
+    def initial(self):
+        return 0
+
+    def update(self, record):
+        self.state += 1
+
+    def merge(self, other):
+        self.state += other.state
+
+
+class FieldCount(CounterAggregator):
+    """
+    Counts the occurrences of each value in a column, e.g. per CHROM or per FILTER.
+
+    :param column: Name of the column.
+    :param split: If given, the value is split by this separator and every item is counted (e.g. ';' for FILTER).
+    """
+
+    def __init__(self, column, split=None, name=None):
+        self.column = column
+        self.split = split
+        self.name = name or '{}_counts'.format(column)
+        super(FieldCount, self).__init__()
+
+    def update(self, record):
+        value = record.get(self.column)
+        if self.split:
+            for v in value.split(self.split):
+                self.state[v] += 1
+        else:
+            self.state[value] += 1
+
+
+class TiTvRatio(CounterAggregator):
+    """
+    Counts transitions and transversions for all single nucleotide alleles.
+    """
+
+    name = 'titv'
+
+    TRANSITIONS = set(['AG', 'GA', 'CT', 'TC'])
+    BASES = set('ACGT')
+
+    def update(self, record):
+        ref = record.get('REF').upper()
+        if len(ref) != 1:
+            return
+        for alt in record.alt:
+            alt = alt.upper()
+            if len(alt) != 1 or alt not in TiTvRatio.BASES or ref not in TiTvRatio.BASES or alt == ref:
+                continue
+            if ref + alt in TiTvRatio.TRANSITIONS:
+                self.state['ti'] += 1
+            else:
+                self.state['tv'] += 1
+
+    def result(self):
+        ti = self.state['ti']
+        tv = self.state['tv']
+        return {
+            'ti': ti,
+            'tv': tv,
+            'ratio': float(ti) / tv if tv else None
+        }
+
+
+class Histogram(BaseAggregator):
+    """
+    Histogram with fixed bin edges, for a numeric column (e.g. QUAL) or INFO field (e.g. AF).
+
+    If the field is not one of the columns, it is read from INFO, where every comma separated
+    value is counted (i.e. one value per allele for Number=A fields).
+    Values missing or not convertible to a number are counted as 'missing'.
+
+    :param field: Column or INFO key.
+    :param edges: Sorted list of bin edges. Bin i covers [edges[i-1], edges[i]), with open bins at both ends.
+    """
+
+    def __init__(self, field, edges, name=None):
+        self.field = field
+        # Must be set before calling super(), as initial() uses it
+        self.edges = sorted(edges)
+        self.name = name or '{}_histogram'.format(field)
+        super(Histogram, self).__init__()
+
+    def initial(self):
+        return {
+            'counts': [0] * (len(self.edges) + 1),
+            'missing': 0
+        }
+
+    def _values(self, record):
+        if self.field in record._columns:
+            return [record.get(self.field)]
+        value = record.info.get(self.field)
+        if value is None or value is True:
+            return [None]
+        return value.split(',')
+
+    def update(self, record):
+        for value in self._values(record):
+            value = Util.conv_to_number(value) if value is not None else None
+            if not isinstance(value, (int, float)):
+                self.state['missing'] += 1
+                continue
+            self.state['counts'][bisect.bisect_right(self.edges, value)] += 1
+
+    def merge(self, other):
+        counts = self.state['counts']
+        for idx, count in enumerate(other.state['counts']):
+            counts[idx] += count
+        self.state['missing'] += other.state['missing']
+
+    def result(self):
+        lower = [None] + self.edges
+        upper = self.edges + [None]
+        return {
+            'bins': [
+                {'lower': l, 'upper': u, 'count': c} for l, u, c in zip(lower, upper, self.state['counts'])
+            ],
+            'missing': self.state['missing']
+        }
+
+
+class ConsequenceCount(CounterAggregator):
+    """
+    Tallies consequence types from the VEP CSQ field. Every consequence is counted once per transcript annotation.
+
+    The position of the Consequence field is read from the header metadata, and the rest of the
+    CSQ data is left unparsed.
+    """
+
+    name = 'consequences'
+
+    def __init__(self, name=None):
+        self.name = name or ConsequenceCount.name
+        self._index = None
+        super(ConsequenceCount, self).__init__()
+
+    def _getIndex(self, meta):
+        if self._index is None:
+            fields = VEPInfoProcessor(meta).fields
+            self._index = fields.index('Consequence') if 'Consequence' in fields else -1
+        return self._index
+
+    def update(self, record):
+        value = record.info.get(VEPInfoProcessor.field)
+        if not value or value is True:
+            return
+        idx = self._getIndex(record.meta)
+        if idx < 0:
+            return
+        for transcript in value.split(','):
+            parts = transcript.split('|')
+            if idx < len(parts) and parts[idx]:
+                for consequence in parts[idx].split('&'):
+                    self.state[consequence] += 1
+
+
+def default_aggregators():
+    """
+    Returns the set of aggregators used by 'python -m vcfiterator stats'.
+    """
+    return [
+        RecordCount(),
+        FieldCount('CHROM'),
+        FieldCount('FILTER', split=';'),
+        TiTvRatio(),
+        Histogram('QUAL', [10, 20, 30, 50, 100, 200, 500, 1000]),
+        Histogram('AF', [0.01, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]),
+        ConsequenceCount()
+    ]
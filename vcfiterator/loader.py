@@ -0,0 +1,296 @@
+import sqlite3
+
+from vcfiterator.processors import VEPInfoProcessor, SnpEffInfoProcessor, CsvAlleleParser
+from vcfiterator.aggregators import RawRecord
+
+# Columns of the variants table, before the INFO fields
+VARIANT_COLUMNS = ['variant_id', 'CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER']
+
+SQL_TYPES = {
+    'Integer': 'INTEGER',
+    'Float': 'REAL',
+    'Double': 'REAL',
+    'Number': 'REAL',
+    'Flag': 'INTEGER'
+}
+
+
+class Table(object):
+    """
+    A table in the database, buffering rows for batched inserts.
+    """
+
+    def __init__(self, name, columns):
+        """
+        :param name: Name of the table.
+        :param columns: List of (column name, SQL type) tuples.
+        """
+        self.name = name
+        self.columns = columns
+        self.rows = list()
+
+    @staticmethod
+    def quote(identifier):
+        return '"{}"'.format(identifier.replace('"', '""'))
+
+    def create(self, conn):
+        """
+        Creates the table, or adds any missing columns if it already exists (e.g. when
+        loading a file with INFO fields not present in the files loaded before).
+        """
+        existing = set(row[1].lower() for row in conn.execute('PRAGMA table_info({})'.format(Table.quote(self.name))))
+        if not existing:
+            conn.execute('CREATE TABLE {} ({})'.format(
+                Table.quote(self.name),
+                ', '.join('{} {}'.format(Table.quote(c), t) for c, t in self.columns)
+            ))
+            return
+        for c, t in self.columns:
+            if c.lower() not in existing:
+                conn.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(Table.quote(self.name), Table.quote(c), t))
+
+    def createIndex(self, conn, *columns):
+        conn.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+            Table.quote('idx_{}_{}'.format(self.name, '_'.join(columns))),
+            Table.quote(self.name),
+            ', '.join(Table.quote(c) for c in columns)
+        ))
+
+    def flush(self, conn):
+        if not self.rows:
+            return
+        conn.executemany('INSERT INTO {} ({}) VALUES ({})'.format(
+            Table.quote(self.name),
+            ', '.join(Table.quote(c) for c, _ in self.columns),
+            ', '.join('?' * len(self.columns))
+        ), self.rows)
+        self.rows = list()
+
+
+class SqliteLoader(object):
+    """
+    Loads the variants of a VcfIterator into a SQLite database.
+
+    The schema is derived from the header metadata:
+
+    - variants: One row per line, with a column per INFO field with a single value for the whole line.
+    - alleles: One row per ALT allele (none for ALT '.'), with the allele specific (Number=A or R) INFO fields.
+    - csq/eff: One row per transcript annotation from VEP/snpEff, if present in the header.
+    - genotypes: One row per sample and line, with a column per FORMAT field.
+
+    Values are inserted as the raw strings from the file ('.' becomes NULL), leaving type conversion to
+    SQLite's column affinity. INFO and FORMAT fields not described in the header are not loaded.
+    Rows are inserted in batches using executemany(), committing every commit_size variants,
+    and indexes are created when all data is loaded.
+    """
+
+    def __init__(self, vcf_iterator, db, batch_size=10000, commit_size=100000):
+        """
+        :param vcf_iterator: VcfIterator to load from.
+        :param db: Path to database file or a sqlite3 connection.
+        :param batch_size: Number of variants to buffer before inserting.
+        :param commit_size: Number of variants per transaction.
+        """
+        self.vcf_iterator = vcf_iterator
+        self.conn = sqlite3.connect(db) if isinstance(db, basestring) else db
+        self.batch_size = batch_size
+        self.commit_size = commit_size
+
+        meta = vcf_iterator.getMeta()
+        self.info_meta = meta['INFO']
+        self.format_meta = meta['FORMAT']
+        self.vep_processor = VEPInfoProcessor(meta)
+        self.eff_processor = SnpEffInfoProcessor(meta)
+
+        self._createTables()
+
+    def _sqlType(self, m, single):
+        if not single:
+            return 'TEXT'
+        return SQL_TYPES.get(m.get('Type'), 'TEXT')
+
+    def _unique(self, names, reserved):
+        """
+        Returns the names not colliding with reserved or earlier names.
+        Column names are case insensitive in SQLite.
+        """
+        seen = set(c.lower() for c in reserved)
+        result = list()
+        for name in names:
+            if name and name.lower() not in seen:
+                seen.add(name.lower())
+                result.append(name)
+        return result
+
+    def _createTables(self):
+        annotated = [VEPInfoProcessor.field, SnpEffInfoProcessor.field]
+        variant_ids = list()
+        allele_ids = list()
+        for m in self.info_meta:
+            if m['ID'] in annotated:
+                continue
+            elif m['Number'] in ['A', 'R'] or m['ID'] in CsvAlleleParser.fields:
+                allele_ids.append(m['ID'])
+            else:
+                variant_ids.append(m['ID'])
+        meta = self.vcf_iterator.getMeta()
+        self.variant_info = [meta.getInfo(i) for i in self._unique(variant_ids, VARIANT_COLUMNS)]
+        self.allele_info = [meta.getInfo(i) for i in self._unique(allele_ids, ['variant_id', 'allele_idx', 'allele'])]
+
+        self.format_fields = self._unique([m['ID'] for m in self.format_meta], ['variant_id', 'sample'])
+        self.format_positions = {k: idx for idx, k in enumerate(self.format_fields)}
+
+        self.tables = {
+            'variants': Table(
+                'variants',
+                [
+                    ('variant_id', 'INTEGER PRIMARY KEY'),
+                    ('CHROM', 'TEXT'),
+                    ('POS', 'INTEGER'),
+                    ('ID', 'TEXT'),
+                    ('REF', 'TEXT'),
+                    ('ALT', 'TEXT'),
+                    ('QUAL', 'REAL'),
+                    ('FILTER', 'TEXT')
+                ] +
+                [(m['ID'], self._sqlType(m, m['Number'] in ['0', '1'])) for m in self.variant_info]
+            ),
+            'alleles': Table(
+                'alleles',
+                [('variant_id', 'INTEGER'), ('allele_idx', 'INTEGER'), ('allele', 'TEXT')] +
+                [(m['ID'], self._sqlType(m, True)) for m in self.allele_info]
+            ),
+            'genotypes': Table(
+                'genotypes',
+                [('variant_id', 'INTEGER'), ('sample', 'TEXT')] +
+                [(f, self._sqlType(meta.getFormat(f), meta.getFormat(f)['Number'] == '1')) for f in self.format_fields]
+            )
+        }
+        for name, processor in [('csq', self.vep_processor), ('eff', self.eff_processor)]:
+            if processor.fields:
+                self.tables[name] = Table(
+                    name,
+                    [('variant_id', 'INTEGER'), ('allele_idx', 'INTEGER')] +
+                    [
+                        (f, 'INTEGER' if processor.converters.get(f) is int else 'TEXT')
+                        for f in self._unique(processor.fields, ['variant_id', 'allele_idx'])
+                    ]
+                )
+
+        for table in self.tables.itervalues():
+            table.create(self.conn)
+
+    def _value(self, value):
+        if value == '.' or value == '':
+            return None
+        return value
+
+    def _loadVariant(self, variant_id, record):
+        info = record.info
+        alleles = record.alt
+
+        self.tables['variants'].rows.append(
+            [variant_id] +
+            [self._value(record.get(c)) for c in VARIANT_COLUMNS[1:]] +
+            [
+                int(m['ID'] in info) if m['Type'] == 'Flag' else self._value(info.get(m['ID']))
+                for m in self.variant_info
+            ]
+        )
+
+        allele_values = list()
+        for m in self.allele_info:
+            values = info.get(m['ID'])
+            values = values.split(',') if isinstance(values, basestring) else list()
+            if m['Number'] == 'R':
+                values = values[1:]
+            allele_values.append(values)
+        rows = self.tables['alleles'].rows
+        for a_idx, allele in enumerate(alleles):
+            # No ALT alleles
+            if allele == '.':
+                continue
+            rows.append(
+                [variant_id, a_idx + 1, allele] +
+                [self._value(values[a_idx]) if a_idx < len(values) else None for values in allele_values]
+            )
+
+        if 'FORMAT' in record._columns:
+            sample_format = record.get('FORMAT').split(':')
+            rows = self.tables['genotypes'].rows
+            for sample in self.vcf_iterator.getSamples():
+                row = [variant_id, sample] + [None] * len(self.format_fields)
+                for k, v in zip(sample_format, record.get(sample).split(':')):
+                    if k in self.format_positions:
+                        row[2 + self.format_positions[k]] = self._value(v)
+                rows.append(row)
+
+        if 'csq' in self.tables and isinstance(info.get(VEPInfoProcessor.field), basestring):
+            self._loadAnnotation(
+                variant_id,
+                [t.split('|') for t in info[VEPInfoProcessor.field].split(',')],
+                self.tables['csq'],
+                self.vep_processor.fields,
+                'ALLELE_NUM',
+                len(alleles)
+            )
+
+        if 'eff' in self.tables and isinstance(info.get(SnpEffInfoProcessor.field), basestring):
+            self._loadAnnotation(
+                variant_id,
+                [self.eff_processor._parseFormat(t) for t in info[SnpEffInfoProcessor.field].split(',')],
+                self.tables['eff'],
+                self.eff_processor.fields,
+                'Genotype_Number',
+                len(alleles)
+            )
+
+    def _loadAnnotation(self, variant_id, transcripts, table, fields, allele_field, n_alleles):
+        columns = [c for c, _ in table.columns[2:]]
+        for values in transcripts:
+            data = {k: self._value(v) for k, v in zip(fields, values)}
+            allele_idx = data.get(allele_field)
+            if allele_idx is None and n_alleles == 1:
+                allele_idx = 1
+            table.rows.append([variant_id, allele_idx] + [data.get(c) for c in columns])
+
+    def _flush(self):
+        for table in self.tables.itervalues():
+            table.flush(self.conn)
+
+    def _createIndexes(self):
+        self.tables['variants'].createIndex(self.conn, 'CHROM', 'POS')
+        for name, table in self.tables.iteritems():
+            if name != 'variants':
+                table.createIndex(self.conn, 'variant_id')
+        self.tables['genotypes'].createIndex(self.conn, 'sample')
+
+    def load(self):
+        """
+        Loads all variants, returning the number of variants loaded.
+        Variants are appended to the tables if they already contain data. Values are inserted by column name,
+        so the order of the fields in the header does not matter, and columns for new fields are added when
+        the loader is created.
+        """
+        first_id = (self.conn.execute('SELECT MAX(variant_id) FROM variants').fetchone()[0] or 0) + 1
+        data_parser = self.vcf_iterator.data_parser
+        columns = {k: idx for idx, k in enumerate(self.vcf_iterator.getHeader())}
+
+        count = 0
+        try:
+            for line in data_parser.iterRange():
+                self._loadVariant(first_id + count, RawRecord(line, columns, data_parser))
+                count += 1
+                if count % self.batch_size == 0:
+                    self._flush()
+                if count % self.commit_size == 0:
+                    self.conn.commit()
+            self._flush()
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        self._createIndexes()
+        self.conn.commit()
+        return count
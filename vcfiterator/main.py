@@ -1,8 +1,13 @@
+import os
 import sys
-from collections import defaultdict
+import hashlib
+import tempfile
+import cPickle
+import multiprocessing
 import re
 
 from vcfiterator.processors import NativeInfoProcessor, CsvAlleleParser
+from vcfiterator.aggregators import RawRecord
 from vcfiterator.util import Util
 
 # Official fields in specification
@@ -19,27 +24,152 @@ SPEC_FIELDS = [
 ]
 
 
+class Metadata(dict):
+    """
+    The metadata (## lines) of the header, by key (e.g. 'INFO' or 'fileformat').
+
+    Structured lines (INFO, FORMAT, FILTER and contig) are always given as a list of dictionaries,
+    and can also be looked up by ID, e.g. getInfo('DP').
+    Other keys are given as a list of values, or a single value if the key was only present once.
+    Missing keys give an empty list.
+    """
+
+    INDEXED = ['INFO', 'FORMAT', 'FILTER', 'contig']
+
+    def __init__(self):
+        super(Metadata, self).__init__()
+        self.index = {k: dict() for k in Metadata.INDEXED}
+
+    def __missing__(self, key):
+        return list()
+
+    def add(self, key, value):
+        self.setdefault(key, list()).append(value)
+        if key in self.index:
+            # First line wins for duplicate IDs
+            self.index[key].setdefault(value.get('ID'), value)
+
+    def getInfo(self, id):
+        return self.index['INFO'].get(id)
+
+    def getFormat(self, id):
+        return self.index['FORMAT'].get(id)
+
+    def getFilter(self, id):
+        return self.index['FILTER'].get(id)
+
+    def getContig(self, id):
+        return self.index['contig'].get(id)
+
+
+class HeaderCache(object):
+    """
+    On-disk cache of parsed headers.
+
+    Entries are keyed by the identity of the file (path, size, modification time and inode),
+    so a modified file is parsed again. Unreadable entries are ignored, and failing to write
+    an entry does not prevent the header from being used.
+
+    Entries only contain plain data (lists, dictionaries and strings). They are read with an
+    unpickler not allowing any classes or functions, so a tampered entry can not run code.
+    """
+
+    VERSION = 3
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _getCachePath(self, path):
+        st = os.stat(path)
+        # repr() keeps the full precision of st_mtime, str() rounds it to 12 digits
+        key = '|'.join(repr(k) for k in [
+            os.path.realpath(path),
+            st.st_size,
+            st.st_mtime,
+            st.st_ino,
+            HeaderCache.VERSION
+        ])
+        return os.path.join(self.cache_dir, hashlib.sha1(key).hexdigest() + '.pickle')
+
+    def get(self, path):
+        try:
+            with open(self._getCachePath(path), 'rb') as f:
+                unpickler = cPickle.Unpickler(f)
+                # Only allow builtin data types
+                unpickler.find_global = None
+                items, header, samples = unpickler.load()
+            meta = Metadata()
+            for key, value in items:
+                if key in Metadata.INDEXED:
+                    for item in value:
+                        meta.add(key, item)
+                else:
+                    meta[key] = value
+            return meta, header, samples
+        except Exception:
+            return None
+
+    def set(self, path, parsed):
+        meta, header, samples = parsed
+        tmp_path = None
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            # Write to a temporary file first, so concurrent readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                cPickle.dump((meta.items(), header, samples), f, cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self._getCachePath(path))
+        except (IOError, OSError):
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
 class HeaderParser(object):
     """
     Class for parsing the header part of the vcf and returns the metadata and header data.
     """
 
-    RE_INFO = re.compile(r'[<]*(.*?)=["]*(.*?)["]*[,>]')
+    RE_INFO = re.compile(r'([^=,]+)=("(?:[^"\\]|\\.)*"|[^,]*),?')
 
-    def __init__(self, path_or_f):
+    def __init__(self, path_or_f, cache_dir=None):
+        """
+        :param path_or_f: Path to .vcf file or an open file object.
+        :param cache_dir: If given, parsed headers are cached in this directory (only when reading from a path).
+        """
         self.path_or_f = path_or_f
+        self.cache = HeaderCache(cache_dir) if cache_dir else None
         self.metaProccessors = {
             'INFO': self._parseMetaInfo,
             'FILTER': self._parseMetaInfo,
-            'FORMAT': self._parseMetaInfo
+            'FORMAT': self._parseMetaInfo,
+            'contig': self._parseMetaInfo
         }
 
     def _getSamples(self, header):
         return [field for field in header if field not in SPEC_FIELDS]
 
     def _parseMetaInfo(self, infoline):
-        groups = re.findall(HeaderParser.RE_INFO, infoline)
-        info = {k: v for k, v in groups}
+        """
+        Parses a structured line like <ID=DP,Number=1,Type=Integer,Description="Total Depth">
+        into a dictionary. Quoted values may contain commas.
+        """
+        if infoline.startswith('<') and infoline.endswith('>'):
+            infoline = infoline[1:-1]
+        if '"' not in infoline:
+            # Fast path, typical for ##contig lines
+            return dict(item.split('=', 1) for item in infoline.split(',') if '=' in item)
+        info = dict()
+        pos = 0
+        while pos < len(infoline):
+            match = HeaderParser.RE_INFO.match(infoline, pos)
+            if not match:
+                break
+            key, value = match.groups()
+            if value.startswith('"') and value.endswith('"'):
+                value = value[1:-1].replace('\\"', '"')
+            info[key] = value
+            pos = match.end()
         return info
 
     def _get_file_obj(self):
@@ -54,38 +184,44 @@ class HeaderParser(object):
         return self.path_or_f
 
     def _parseHeader(self):
-        meta = defaultdict(list)
+        meta = Metadata()
         header = list()
 
-        # Read in metadata and header
+        # Read in metadata and header, extracting data with processors
         f = self._get_file_obj()
-        for line in f.xreadlines():
-            line = line.replace('\n', '')
-            if line.startswith('##'):
-                key, value = line[2:].split('=', 1)
-                meta[key].append(value)
-            elif(line.startswith('#')):
-                line = line.replace('#', '')
-                header = line.split('\t')
-            else:
-                # End of header
-                break
-
-        # Extract data with processors
-        for key, func in self.metaProccessors.iteritems():
-            if key in meta:
-                for idx, value in enumerate(meta[key]):
-                    meta[key][idx] = func(value)
+        try:
+            for line in f.xreadlines():
+                line = line.rstrip('\r\n')
+                if line.startswith('##'):
+                    key, value = line[2:].split('=', 1)
+                    if key in self.metaProccessors:
+                        value = self.metaProccessors[key](value)
+                    meta.add(key, value)
+                elif(line.startswith('#')):
+                    line = line.replace('#', '')
+                    header = line.split('\t')
+                else:
+                    # End of header
+                    break
+        finally:
+            if isinstance(self.path_or_f, basestring):
+                f.close()
 
-        # Extract value from single-item lists ([val] -> val):
+        # Extract value from single-item lists ([val] -> val), except for lines that can be looked up by ID:
         for k, v in meta.iteritems():
-            if len(v) == 1:
+            if len(v) == 1 and k not in Metadata.INDEXED:
                 meta[k] = v[0]
 
         samples = self._getSamples(header)
         return meta, header, samples
 
     def parse(self):
+        if self.cache and isinstance(self.path_or_f, basestring):
+            parsed = self.cache.get(self.path_or_f)
+            if parsed is None:
+                parsed = self._parseHeader()
+                self.cache.set(self.path_or_f, parsed)
+            return parsed
         return self._parseHeader()
 
 
@@ -211,13 +347,113 @@ class DataParser(object):
         finally:
             f.close()
 
+    def _findDataStart(self, f):
+        """
+        Reads f until the #CHROM line, returning the offset of the first data line.
+        """
+        offset = 0
+        for line in iter(f.readline, ''):
+            offset += len(line)
+            if line.startswith('#CHROM'):
+                break
+        return offset
+
+    def splitRanges(self, count):
+        """
+        Splits the data part of the file into (at most) count byte ranges of roughly equal size.
+        Ranges do not need to start at line boundaries, see iterRange().
+        """
+        f = self._get_file_obj()
+        try:
+            start = self._findDataStart(f)
+        finally:
+            f.close()
+        size = os.path.getsize(self.path_or_f)
+        step = max((size - start) / count, 1)
+        edges = range(start, size, step)[:count] + [size]
+        return zip(edges[:-1], edges[1:])
+
+    def iterRange(self, start=None, end=None):
+        """
+        Iterates over the raw data lines starting within the byte range [start, end).
+        A line is included in the range where it starts, so adjacent ranges never overlap.
+        Blank lines are skipped.
+
+        If start is None, iteration starts at the first data line. If end is None, it stops at end of file.
+        """
+        f = self._get_file_obj()
+        try:
+            if start is None:
+                pos = self._findDataStart(f)
+            else:
+                # Skip ahead to the first line starting at or after start
+                f.seek(max(start - 1, 0))
+                pos = f.tell()
+                if start > 0:
+                    pos += len(f.readline())
+            for line in iter(f.readline, ''):
+                if end is not None and pos >= end:
+                    break
+                pos += len(line)
+                line = line.rstrip('\r\n')
+                if line:
+                    yield line
+        finally:
+            if isinstance(self.path_or_f, basestring):
+                f.close()
+
+    def aggregate(self, aggregators, start=None, end=None, throw_exceptions=True):
+        """
+        Runs all aggregators over the data lines in the given byte range (see iterRange()).
+
+        With throw_exceptions=False, lines failing to split into ALT and INFO are skipped by all aggregators.
+        An exception raised by an aggregator itself is not rolled back, so aggregators
+        earlier in the list will already have counted that line.
+        """
+        columns = {k: idx for idx, k in enumerate(self.header)}
+        for line in self.iterRange(start=start, end=end):
+            try:
+                record = RawRecord(line, columns, self)
+                # Parse the shared fields up front, so a malformed line fails before any aggregator is updated
+                record.alt
+                record.info
+                for aggregator in aggregators:
+                    aggregator.update(record)
+            except Exception:
+                if throw_exceptions:
+                    raise
+                else:
+                    sys.stderr.write("WARNING: Line failed to aggregate: \n {}\n".format(line))
+        return aggregators
+
+
+def _aggregateChunk(args):
+    """
+    Worker for VcfIterator.aggregate(), running in a separate process.
+    Returns the aggregators with the partial state for one byte range.
+    """
+    path, meta, header, samples, processors, aggregators, start, end, throw_exceptions = args
+    data_parser = DataParser(path, meta, header, samples)
+    for processor in processors:
+        data_parser.addInfoProcessor(processor(meta))
+    for aggregator in aggregators:
+        aggregator.reset()
+    return data_parser.aggregate(aggregators, start=start, end=end, throw_exceptions=throw_exceptions)
+
 
 class VcfIterator(object):
 
-    def __init__(self, path_or_f):
+    def __init__(self, path_or_f, header_cache_dir=None):
+        """
+        :param path_or_f: Path to .vcf file or an open file object.
+        :param header_cache_dir: Directory for caching parsed headers between runs.
+            Defaults to the environment variable VCFITERATOR_HEADER_CACHE, if set.
+        """
         self.path_or_f = path_or_f
-        self.meta, self.header, self.samples = HeaderParser(self.path_or_f).parse()
+        cache_dir = header_cache_dir or os.environ.get('VCFITERATOR_HEADER_CACHE')
+        self.meta, self.header, self.samples = HeaderParser(self.path_or_f, cache_dir=cache_dir).parse()
         self.data_parser = DataParser(self.path_or_f, self.meta, self.header, self.samples)
+        self.processors = list()
 
         # Add by default
         self.addInfoProcessor(CsvAlleleParser)
@@ -232,8 +468,39 @@ class VcfIterator(object):
         return self.samples
 
     def addInfoProcessor(self, processor):
+        self.processors.append(processor)
         self.data_parser.addInfoProcessor(processor(self.meta))
 
     def iter(self, throw_exceptions=True, include_raw=False):
         for r in self.data_parser.iter(throw_exceptions=throw_exceptions, include_raw=include_raw):
             yield r
+
+    def aggregate(self, aggregators, processes=1, throw_exceptions=True):
+        """
+        Runs a set of aggregators (see aggregators.py) over all variants in a single pass,
+        and returns a dictionary with the result of each aggregator.
+
+        The aggregators are updated in place, so their states can be merged with results from other runs.
+
+        :param aggregators: List of aggregator instances.
+        :param processes: Number of processes to split the work over. Only supported when reading from a path.
+        """
+        if processes > 1 and isinstance(self.path_or_f, basestring):
+            ranges = self.data_parser.splitRanges(processes * 4)
+            tasks = [
+                (self.path_or_f, self.meta, self.header, self.samples, self.processors, aggregators, start, end, throw_exceptions)
+                for start, end in ranges
+            ]
+            pool = multiprocessing.Pool(processes)
+            try:
+                partials = pool.map(_aggregateChunk, tasks)
+            finally:
+                pool.close()
+                pool.join()
+            for partial in partials:
+                for aggregator, other in zip(aggregators, partial):
+                    aggregator.merge(other)
+        else:
+            self.data_parser.aggregate(aggregators, throw_exceptions=throw_exceptions)
+
+        return {a.name: a.result() for a in aggregators}
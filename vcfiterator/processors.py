@@ -38,8 +38,7 @@ class BaseInfoProcessor(object):
         pass
 
     def getConvertFunction(self, meta, key):
-        # Search for meta item
-        f = next((m for m in meta['INFO'] if m['ID'] == key), None)
+        f = meta.getInfo(key)
         func = lambda x: x.decode('latin-1', 'replace')
         if f:
             parse_func = Util.dot_to_none(lambda x: x.decode('latin-1', 'replace'))
@@ -102,7 +101,7 @@ class VEPInfoProcessor(BaseInfoProcessor):
         }
 
     def _parseFieldsFromMeta(self):
-        info_line = next((l for l in self.meta['INFO'] if l.get('ID') == VEPInfoProcessor.field), None)
+        info_line = self.meta.getInfo(VEPInfoProcessor.field)
         if info_line:
             fields = info_line['Description'].split('Format: ', 1)[1].split('|')
             return fields
@@ -171,7 +170,7 @@ class SnpEffInfoProcessor(BaseInfoProcessor):
         return fields
 
     def _parseFieldsFromMeta(self):
-        info_line = next((l for l in self.meta['INFO'] if l.get('ID') == SnpEffInfoProcessor.field), None)
+        info_line = self.meta.getInfo(SnpEffInfoProcessor.field)
         if info_line:
             fields = self._parseFormat(info_line['Description'].split('Format: \'', 1)[1])
             fields.append('ERRORS')
@@ -229,6 +228,8 @@ class NativeInfoProcessor(BaseInfoProcessor):
 
         def __init__(self, meta):
             super(NativeInfoProcessor, self).__init__(meta)
+            # Convert functions by key, created on first use
+            self.converters = dict()
 
         def accepts(self, key, value, processed):
             return not processed
@@ -238,6 +239,8 @@ class NativeInfoProcessor(BaseInfoProcessor):
             if isinstance(value, bool):
                 info_data['ALL'][key] = value
             else:
-                func = self.getConvertFunction(self.meta, key)
+                func = self.converters.get(key)
+                if func is None:
+                    func = self.converters[key] = self.getConvertFunction(self.meta, key)
                 # We ignore alleles for these values, but return them in the 'ALL' key
                 info_data['ALL'][key] = func(value)
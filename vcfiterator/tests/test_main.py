@@ -1,7 +1,15 @@
+import os
+import shutil
+import cPickle
+import sqlite3
+import tempfile
 import unittest
 from StringIO import StringIO
 
 from vcfiterator import VcfIterator
+from vcfiterator.main import HeaderParser, HeaderCache, Metadata
+from vcfiterator.aggregators import RecordCount, FieldCount, TiTvRatio, Histogram, default_aggregators
+from vcfiterator.loader import SqliteLoader
 
 class StringIOWrapper(StringIO):
     """
@@ -81,6 +89,107 @@ class TestHeaderParser(unittest.TestCase):
             ]
         )
 
+    def test_meta_lookup(self):
+        meta = VcfIterator(get_vcf_file_obj(None)).getMeta()
+        self.assertEquals(meta['fileformat'], 'VCFv4.1')
+        self.assertEquals(
+            meta.getInfo('DB'),
+            {
+                'ID': 'DB',
+                'Number': '0',
+                'Type': 'Flag',
+                'Description': 'dbSNP membership, build 129'
+            }
+        )
+        self.assertEquals(meta.getFormat('GQ')['Type'], 'Integer')
+        self.assertEquals(meta.getFilter('s50')['Description'], 'Less than 50% of samples have data')
+        self.assertEquals(meta.getContig('20')['species'], 'Homo sapiens')
+        self.assertIsNone(meta.getInfo('MISSING'))
+        # Lines with ID are never collapsed into a single item
+        self.assertEquals(len(meta['contig']), 1)
+
+    def test_crlf(self):
+        v = '20\t14370\trs6054257\tG\tA\t29\tPASS\tNS=3;DP=14;AF=0.5;DB;H2\tGT:GQ:DP:HQ\t0|0:48:1:51,51\t1|0:48:8:51,51\t1/1:43:5:.,.'
+        vi = VcfIterator(StringIOWrapper('\r\n'.join([HEADER.replace('\n', '\r\n'), v])))
+        self.assertEquals(vi.getSamples(), ['TESTSAMPLE1', 'TESTSAMPLE2', 'TESTSAMPLE3'])
+        self.assertEquals(
+            [m['ID'] for m in vi.getMeta()['INFO']],
+            ['NS', 'DP', 'AF', 'AA', 'DB', 'H2']
+        )
+        self.assertEquals(vi.getMeta().getInfo('DP')['Type'], 'Integer')
+        self.assertEquals(vi.getMeta().getContig('20')['taxonomy'], 'x')
+        data = list(vi.iter())[0]
+        self.assertEquals(data['INFO']['ALL']['DP'], 14)
+        self.assertEquals(data['INFO']['ALL']['NS'], 3)
+
+    def test_header_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(os.path.dirname(__file__), 'test.vcf')
+            vi = VcfIterator(path, header_cache_dir=cache_dir)
+            self.assertEquals(len(os.listdir(cache_dir)), 1)
+
+            cached = VcfIterator(path, header_cache_dir=cache_dir)
+            self.assertEquals(cached.getSamples(), ['NA00001', 'NA00002', 'NA00003'])
+            self.assertEquals(cached.getMeta(), vi.getMeta())
+            self.assertEquals(cached.getMeta().getInfo('DP')['Type'], 'Integer')
+
+            # Entries are used instead of parsing the file again
+            calls = list()
+            original = HeaderParser._parseHeader
+
+            def counting(parser):
+                calls.append(parser)
+                return original(parser)
+
+            HeaderParser._parseHeader = counting
+            try:
+                self.assertEquals(VcfIterator(path, header_cache_dir=cache_dir).getHeader(), vi.getHeader())
+            finally:
+                HeaderParser._parseHeader = original
+            self.assertEquals(len(calls), 0)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_header_cache_mtime_precision(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'test.vcf')
+            open(path, 'w').close()
+            cache = HeaderCache(tmp_dir)
+            os.utime(path, (1791234567.123, 1791234567.123))
+            first = cache._getCachePath(path)
+            os.utime(path, (1791234567.124, 1791234567.124))
+            self.assertNotEquals(cache._getCachePath(path), first)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_header_cache_rejects_objects(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(os.path.dirname(__file__), 'test.vcf')
+            cache = HeaderCache(cache_dir)
+            # An entry referring to anything but builtin data types is ignored
+            with open(cache._getCachePath(path), 'wb') as f:
+                cPickle.dump((Metadata().items(), ['CHROM'], [shutil.rmtree]), f)
+            self.assertIsNone(cache.get(path))
+            self.assertEquals(VcfIterator(path, header_cache_dir=cache_dir).getSamples(), ['NA00001', 'NA00002', 'NA00003'])
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_header_cache_unwritable(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            # Parent of the cache directory is a regular file
+            not_a_dir = os.path.join(tmp_dir, 'file')
+            open(not_a_dir, 'w').close()
+            path = os.path.join(os.path.dirname(__file__), 'test.vcf')
+            vi = VcfIterator(path, header_cache_dir=os.path.join(not_a_dir, 'cache'))
+            self.assertEquals(vi.getSamples(), ['NA00001', 'NA00002', 'NA00003'])
+            self.assertEquals(os.listdir(tmp_dir), ['file'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
 
 class TestDataParser(unittest.TestCase):
 
@@ -134,3 +243,155 @@ class TestDataParser(unittest.TestCase):
                 'HQ': ['.', '.']
             }
         )
+
+
+class TestAggregators(unittest.TestCase):
+
+    VARIANTS = '\n'.join([
+        '20\t14370\trs6054257\tG\tA\t29\tPASS\tNS=3;DP=14;AF=0.5;DB;H2\tGT:GQ:DP:HQ\t0|0:48:1:51,51\t1|0:48:8:51,51\t1/1:43:5:.,.',
+        '20\t17330\t.\tT\tA\t3\tq10\tNS=3;DP=11;AF=0.017\tGT:GQ:DP:HQ\t0|0:49:3:58,50\t0|1:3:5:65,3\t0/0:41:3',
+        '20\t1110696\trs6040355\tA\tG,T\t67\tPASS\tNS=2;DP=10;AF=0.333,0.667;AA=T;DB\tGT:GQ:DP:HQ\t1|2:21:6:23,27\t2|1:2:0:18,2\t2/2:35:4',
+        '20\t1230237\t.\tT\t.\t47\tq10;s50\tNS=3;DP=13;AA=T\tGT:GQ:DP:HQ\t0|0:54:7:56,60\t0|0:48:4:51,51\t0/0:61:2'
+    ])
+
+    def test_aggregate(self):
+        vi = VcfIterator(get_vcf_file_obj(TestAggregators.VARIANTS))
+        result = vi.aggregate([
+            RecordCount(),
+            FieldCount('FILTER', split=';'),
+            TiTvRatio(),
+            Histogram('AF', [0.1, 0.5])
+        ])
+        self.assertEquals(result['records'], 4)
+        self.assertEquals(result['FILTER_counts'], {'PASS': 2, 'q10': 2, 's50': 1})
+        self.assertEquals(result['titv'], {'ti': 2, 'tv': 2, 'ratio': 1.0})
+        self.assertEquals(
+            [b['count'] for b in result['AF_histogram']['bins']],
+            [1, 1, 2]
+        )
+        self.assertEquals(result['AF_histogram']['missing'], 1)
+
+    def test_merge(self):
+        first = [RecordCount(), FieldCount('FILTER')]
+        second = [RecordCount(), FieldCount('FILTER')]
+        VcfIterator(get_vcf_file_obj(TestAggregators.VARIANTS)).aggregate(first)
+        VcfIterator(get_vcf_file_obj(TestAggregators.VARIANTS)).aggregate(second)
+        for a, b in zip(first, second):
+            a.merge(b)
+        self.assertEquals(first[0].result(), 8)
+        self.assertEquals(first[1].result(), {'PASS': 4, 'q10': 2, 'q10;s50': 2})
+
+    def test_malformed_line(self):
+        variants = TestAggregators.VARIANTS + '\n20\t1234567\t.\tG\tA'
+        vi = VcfIterator(get_vcf_file_obj(variants))
+        result = vi.data_parser.aggregate([RecordCount(), FieldCount('CHROM')], throw_exceptions=False)
+        # The malformed line is skipped by all aggregators
+        self.assertEquals([a.result() for a in result], [4, {'20': 4}])
+
+    def test_blank_lines(self):
+        vi = VcfIterator(get_vcf_file_obj(TestAggregators.VARIANTS + '\n\n'))
+        self.assertEquals(vi.aggregate([RecordCount()]), {'records': 4})
+
+    def test_parallel(self):
+        path = os.path.join(os.path.dirname(__file__), 'test.vcf')
+        serial = VcfIterator(path).aggregate(default_aggregators())
+        parallel = VcfIterator(path).aggregate(default_aggregators(), processes=2)
+        self.assertEquals(serial, parallel)
+        self.assertEquals(serial['records'], 2)
+
+
+class TestSqliteLoader(unittest.TestCase):
+
+    def get_db(self):
+        conn = sqlite3.connect(':memory:')
+        vi = VcfIterator(get_vcf_file_obj(TestAggregators.VARIANTS))
+        count = SqliteLoader(vi, conn, batch_size=3, commit_size=3).load()
+        self.assertEquals(count, 4)
+        return conn
+
+    def test_variants(self):
+        conn = self.get_db()
+        rows = conn.execute('SELECT CHROM, POS, ID, ALT, QUAL, FILTER, NS, DB, AA FROM variants ORDER BY variant_id').fetchall()
+        self.assertEquals(rows[0], ('20', 14370, 'rs6054257', 'A', 29.0, 'PASS', 3, 1, None))
+        self.assertEquals(rows[2], ('20', 1110696, 'rs6040355', 'G,T', 67.0, 'PASS', 2, 1, 'T'))
+        self.assertEquals(rows[3][2], None)
+        self.assertEquals(rows[3][7], 0)
+
+    def test_alleles(self):
+        conn = self.get_db()
+        rows = conn.execute('SELECT variant_id, allele_idx, allele, AF FROM alleles WHERE variant_id = 3 ORDER BY allele_idx').fetchall()
+        self.assertEquals(rows, [(3, 1, 'G', 0.333), (3, 2, 'T', 0.667)])
+
+    def test_genotypes(self):
+        conn = self.get_db()
+        rows = conn.execute('SELECT sample, GT, GQ, DP, HQ FROM genotypes WHERE variant_id = 1 ORDER BY sample').fetchall()
+        self.assertEquals(
+            rows,
+            [
+                ('TESTSAMPLE1', '0|0', 48, 1, '51,51'),
+                ('TESTSAMPLE2', '1|0', 48, 8, '51,51'),
+                ('TESTSAMPLE3', '1/1', 43, 5, '.,.')
+            ]
+        )
+        self.assertEquals(
+            conn.execute('SELECT HQ FROM genotypes WHERE variant_id = 2 AND sample = ?', ('TESTSAMPLE3',)).fetchone(),
+            (None,)
+        )
+
+    def test_no_alt(self):
+        conn = self.get_db()
+        self.assertEquals(conn.execute('SELECT COUNT(*) FROM alleles WHERE variant_id = 4').fetchone(), (0,))
+
+    def test_append(self):
+        conn = self.get_db()
+        vi = VcfIterator(get_vcf_file_obj(TestAggregators.VARIANTS))
+        self.assertEquals(SqliteLoader(vi, conn).load(), 4)
+        self.assertEquals(
+            conn.execute('SELECT variant_id, POS FROM variants ORDER BY variant_id').fetchall(),
+            [(1, 14370), (2, 17330), (3, 1110696), (4, 1230237), (5, 14370), (6, 17330), (7, 1110696), (8, 1230237)]
+        )
+        self.assertEquals(
+            conn.execute('SELECT allele FROM alleles WHERE variant_id = 7 ORDER BY allele_idx').fetchall(),
+            [('G',), ('T',)]
+        )
+
+    def test_append_different_header(self):
+        conn = self.get_db()
+        # NS and DP in the opposite order, and a field not present in the first file
+        header = HEADER.replace(
+            '##INFO=<ID=NS,Number=1,Type=Integer,Description="Number of Samples With Data">\n'
+            '##INFO=<ID=DP,Number=1,Type=Integer,Description="Total Depth">',
+            '##INFO=<ID=XX,Number=1,Type=Integer,Description="Extra">\n'
+            '##INFO=<ID=DP,Number=1,Type=Integer,Description="Total Depth">\n'
+            '##INFO=<ID=NS,Number=1,Type=Integer,Description="Number of Samples With Data">'
+        )
+        self.assertNotEquals(header, HEADER)
+        variants = '20\t14370\t.\tG\tA\t29\tPASS\tNS=3;DP=99;XX=7\tGT\t0|0\t1|0\t1/1'
+        vi = VcfIterator(StringIOWrapper(header + '\n' + variants))
+        self.assertEquals(SqliteLoader(vi, conn).load(), 1)
+        self.assertEquals(
+            conn.execute('SELECT variant_id, NS, DP, XX FROM variants WHERE variant_id IN (1, 5) ORDER BY variant_id').fetchall(),
+            [(1, 3, 14, None), (5, 3, 99, 7)]
+        )
+
+    def test_csq(self):
+        header = '\n'.join([
+            '##fileformat=VCFv4.1',
+            '##INFO=<ID=CSQ,Number=.,Type=String,Description="Consequence type as predicted by VEP. Format: Allele|Gene|Consequence|DISTANCE|ALLELE_NUM">',
+            '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO'
+        ])
+        variants = '\n'.join([
+            '1\t100\t.\tC\tA,T\t20\tPASS\tCSQ=A|G1|stop_gained&splice_region_variant||1,T|G1|missense_variant|5|2',
+            '1\t200\t.\tC\tG\t20\tPASS\tCSQ=G|G2|intron_variant||'
+        ])
+        conn = sqlite3.connect(':memory:')
+        SqliteLoader(VcfIterator(StringIOWrapper(header + '\n' + variants)), conn).load()
+        self.assertEquals(
+            conn.execute('SELECT variant_id, allele_idx, Allele, Consequence, DISTANCE FROM csq ORDER BY variant_id, allele_idx').fetchall(),
+            [
+                (1, 1, 'A', 'stop_gained&splice_region_variant', None),
+                (1, 2, 'T', 'missense_variant', 5),
+                # Single allele without ALLELE_NUM
+                (2, 1, 'G', 'intron_variant', None)
+            ]
+        )